@@ -1,10 +1,32 @@
-import subprocess
+import asyncio
+import hashlib
+import json
 import os
-import time
 import io
-from typing import Dict, List, Tuple, Optional
+import re
+import shutil
+import string
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional
+import httpx
+from ollama import AsyncClient, Client, ResponseError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_fixed
 from PIL import Image
 from PyPDF2 import PdfReader
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+try:
+    import numba
+    import numpy as np
+except ImportError:
+    numba = None
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage, KeepTogether
@@ -13,6 +35,143 @@ from reportlab.lib.colors import Color
 from dataclasses import dataclass
 from pathlib import Path
 
+_LEVEL_SECTION_RE = re.compile(r'===\s*(BEGINNER|INTERMEDIATE|ADVANCED)\s*===', re.IGNORECASE)
+_UPPERCASE_RE = re.compile(r'[A-Z]')
+
+# Decode time scales linearly with emitted tokens, so cap it: batched calls
+# carry three sections and stop as soon as the model writes the end marker,
+# single-level calls get a tighter budget.
+_BATCH_OPTIONS = {'num_predict': 1536, 'stop': ['=== END ===']}
+_SINGLE_LEVEL_OPTIONS = {'num_predict': 512}
+
+_SUBTITLE_SPACE = 0.3 * inch
+_SECTION_SPACE = 0.1 * inch
+
+def _create_custom_styles() -> Dict[str, ParagraphStyle]:
+    """Create the custom paragraph styles shared by every explainer."""
+    styles = getSampleStyleSheet()
+    return {
+        'Title': ParagraphStyle(
+            'Title',
+            parent=styles['Title'],
+            fontSize=24,
+            spaceAfter=30,
+            alignment=1
+        ),
+        'Heading1': ParagraphStyle(
+            'Heading1',
+            parent=styles['Heading1'],
+            fontSize=18,
+            spaceAfter=20
+        ),
+        'Normal': ParagraphStyle(
+            'CustomNormal',
+            parent=styles['Normal'],
+            fontSize=12,
+            spaceAfter=12,
+            leading=16
+        ),
+        'Topic': ParagraphStyle(
+            'Topic',
+            parent=styles['Heading2'],
+            fontSize=16,
+            spaceAfter=15,
+            textColor=Color(0.2, 0.2, 0.6)
+        ),
+        'ImageCaption': ParagraphStyle(
+            'ImageCaption',
+            parent=styles['Normal'],
+            fontSize=10,
+            alignment=1,
+            textColor=Color(0.3, 0.3, 0.3)
+        )
+    }
+
+_CUSTOM_STYLES = _create_custom_styles()
+
+_ASCII_LOWER_TABLE = bytes.maketrans(string.ascii_uppercase.encode(),
+                                     string.ascii_lowercase.encode())
+
+_CONTENT_MARKERS = {
+    'technical': ['algorithm', 'implementation', 'system', 'process', 'technical', 'architecture'],
+    'scientific': ['experiment', 'research', 'study', 'analysis', 'data', 'methodology'],
+    'theoretical': ['theory', 'concept', 'principle', 'framework', 'model', 'approach'],
+    'educational': ['learn', 'understand', 'explain', 'example', 'practice', 'exercise'],
+    'business': ['strategy', 'market', 'business', 'management', 'organization', 'planning']
+}
+
+_CONTENT_MARKER_BYTES = {category: [word.encode('utf-8') for word in words]
+                         for category, words in _CONTENT_MARKERS.items()}
+
+def _build_marker_automaton():
+    """Compile every content marker into one Aho-Corasick automaton."""
+    automaton = ahocorasick.Automaton()
+    for category, words in _CONTENT_MARKERS.items():
+        for word in words:
+            automaton.add_word(word, category)
+    automaton.make_automaton()
+    return automaton
+
+_MARKER_AUTOMATON = _build_marker_automaton() if ahocorasick is not None else None
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _count_occurrences(data, word):
+        """Count (possibly overlapping) occurrences of word in data."""
+        count = 0
+        for i in range(data.size - word.size + 1):
+            matched = True
+            for j in range(word.size):
+                if data[i + j] != word[j]:
+                    matched = False
+                    break
+            if matched:
+                count += 1
+        return count
+
+    _CONTENT_MARKER_ARRAYS = {
+        category: [np.frombuffer(word, dtype=np.uint8) for word in words]
+        for category, words in _CONTENT_MARKER_BYTES.items()
+    }
+else:
+    _count_occurrences = None
+
+def _iter_chunks(note_text: str, chunk_size: int) -> Iterator[str]:
+    """Yield bounded windows of note_text without materializing every slice up front.
+
+    The text is encoded once and read through a memoryview, so each
+    window is copied out only when it is consumed; window ends are pulled
+    back to the nearest UTF-8 boundary so multibyte characters never split.
+    """
+    data = note_text.encode('utf-8')
+    view = memoryview(data)
+    start = 0
+    while start < len(data):
+        end = min(start + chunk_size, len(data))
+        while end > start and end < len(data) and (data[end] & 0xC0) == 0x80:
+            end -= 1
+        if end == start:
+            # chunk_size is smaller than the next character; emit it whole
+            # rather than looping on an unsplittable window.
+            end = start + 1
+            while end < len(data) and (data[end] & 0xC0) == 0x80:
+                end += 1
+        yield bytes(view[start:end]).decode('utf-8')
+        start = end
+
+# Below this page count, sharding overhead (worker spawn, one document
+# open per shard, pickled results) outweighs the parallel speedup.
+_MIN_PAGES_PER_SHARD = 4
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> str:
+    """Extract a contiguous page range; module-level so it runs in worker processes."""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return ' '.join(pdf[index].get_textpage().get_text_range() or ""
+                        for index in range(start, stop))
+    finally:
+        pdf.close()
+
 @dataclass
 class ImageInfo:
     path: str
@@ -22,65 +181,55 @@ class ImageInfo:
 class ContentExplainer:
     def __init__(self, temp_dir: str = "temp_images"):
         """Initialize the ContentExplainer with custom styles and temporary directory."""
-        self.styles = getSampleStyleSheet()
-        self.custom_styles = self._create_custom_styles()
+        self.custom_styles = _CUSTOM_STYLES
         self.image_counter = 0
         self.temp_image_dir = Path(temp_dir)
         self.temp_image_dir.mkdir(exist_ok=True)
+        self._client = Client(
+            host=os.environ.get('OLLAMA_HOST', 'http://localhost:11434'),
+            timeout=120
+        )
+        self._llm_cache_dir = Path('.llm_cache')
+        self._llm_cache_dir.mkdir(exist_ok=True)
+        self._pdf_cache_dir = Path('.pdf_cache')
+        self._pdf_cache_dir.mkdir(exist_ok=True)
+        self._extraction_cache: Dict[Tuple[str, float, int], Tuple[str, str]] = {}
 
-    def _create_custom_styles(self) -> Dict[str, ParagraphStyle]:
-        """Create and return custom paragraph styles."""
-        return {
-            'Title': ParagraphStyle(
-                'Title',
-                parent=self.styles['Title'],
-                fontSize=24,
-                spaceAfter=30,
-                alignment=1
-            ),
-            'Heading1': ParagraphStyle(
-                'Heading1',
-                parent=self.styles['Heading1'],
-                fontSize=18,
-                spaceAfter=20
-            ),
-            'Normal': ParagraphStyle(
-                'CustomNormal',
-                parent=self.styles['Normal'],
-                fontSize=12,
-                spaceAfter=12,
-                leading=16
-            ),
-            'Topic': ParagraphStyle(
-                'Topic',
-                parent=self.styles['Heading2'],
-                fontSize=16,
-                spaceAfter=15,
-                textColor=Color(0.2, 0.2, 0.6)
-            ),
-            'ImageCaption': ParagraphStyle(
-                'ImageCaption',
-                parent=self.styles['Normal'],
-                fontSize=10,
-                alignment=1,
-                textColor=Color(0.3, 0.3, 0.3)
-            )
-        }
+    def _llm_cache_path(self, prompt: str) -> Path:
+        """Return the on-disk cache file for a (model, prompt) pair."""
+        key = hashlib.sha256(f"llama3.2\n{prompt}".encode('utf-8')).hexdigest()
+        return self._llm_cache_dir / f"{key}.txt"
+
+    def _llm_cache_get(self, prompt: str) -> Optional[str]:
+        path = self._llm_cache_path(prompt)
+        if path.exists():
+            return path.read_text(encoding='utf-8')
+        return None
+
+    def _llm_cache_set(self, prompt: str, response: str) -> None:
+        self._llm_cache_path(prompt).write_text(response, encoding='utf-8')
 
     def detect_content_type(self, text: str) -> str:
         """Detect the type of content based on keyword frequency."""
-        markers = {
-            'technical': ['algorithm', 'implementation', 'system', 'process', 'technical', 'architecture'],
-            'scientific': ['experiment', 'research', 'study', 'analysis', 'data', 'methodology'],
-            'theoretical': ['theory', 'concept', 'principle', 'framework', 'model', 'approach'],
-            'educational': ['learn', 'understand', 'explain', 'example', 'practice', 'exercise'],
-            'business': ['strategy', 'market', 'business', 'management', 'organization', 'planning']
-        }
-        
-        text = text.lower()
-        scores = {category: sum(text.count(marker) for marker in markers[category])
-                 for category in markers}
-        
+        # The markers are pure ASCII, so a single 256-entry bytes.translate
+        # pass lowers A-Z without the full Unicode case mapping of str.lower().
+        data = text.encode('utf-8').translate(_ASCII_LOWER_TABLE)
+        scores = dict.fromkeys(_CONTENT_MARKERS, 0)
+
+        if _MARKER_AUTOMATON is not None:
+            # One automaton pass over the text scores every marker at once.
+            for _, category in _MARKER_AUTOMATON.iter(data.decode('utf-8')):
+                scores[category] += 1
+        elif _count_occurrences is not None:
+            # JIT-compiled inner loop over the raw bytes when the
+            # automaton is unavailable.
+            array = np.frombuffer(data, dtype=np.uint8)
+            for category, words in _CONTENT_MARKER_ARRAYS.items():
+                scores[category] = sum(_count_occurrences(array, word) for word in words)
+        else:
+            for category, words in _CONTENT_MARKER_BYTES.items():
+                scores[category] = sum(data.count(word) for word in words)
+
         return max(scores.items(), key=lambda x: x[1])[0]
 
     def generate_prompts(self, content_type: str) -> Dict[str, str]:
@@ -117,71 +266,191 @@ class ContentExplainer:
 
     def extract_text_and_title_from_pdf(self, pdf_path: str) -> Tuple[str, str]:
         """Extract text and title from PDF file."""
+        stat = os.stat(pdf_path)
+        cache_key = (pdf_path, stat.st_mtime, stat.st_size)
+        if cache_key in self._extraction_cache:
+            return self._extraction_cache[cache_key]
+
         try:
-            with open(pdf_path, "rb") as file:
-                pdf_reader = PdfReader(file)
-                title = pdf_reader.metadata.get('/Title', '')
-                
-                if not title:
-                    first_page_text = pdf_reader.pages[0].extract_text()
-                    title = first_page_text.split('\n')[0].strip()
-                
-                text = [page.extract_text() or "" for page in pdf_reader.pages]
-                return title, ' '.join(text)
-                
+            # Hashing the file is one sequential read, far cheaper than
+            # re-parsing it, so the same PDF survives renames and reruns.
+            digest = hashlib.sha256(Path(pdf_path).read_bytes()).hexdigest()
+            disk_path = self._pdf_cache_dir / f"{digest}.json"
+            if disk_path.exists():
+                cached = json.loads(disk_path.read_text(encoding='utf-8'))
+                self._extraction_cache[cache_key] = (cached['title'], cached['text'])
+                return self._extraction_cache[cache_key]
+
+            if pdfium is not None:
+                title, text = self._extract_with_pdfium(pdf_path)
+            else:
+                title, text = self._extract_with_pypdf2(pdf_path)
+
+            disk_path.write_text(json.dumps({'title': title, 'text': text}),
+                                 encoding='utf-8')
+            self._extraction_cache[cache_key] = (title, text)
+            return self._extraction_cache[cache_key]
+
         except Exception as e:
             raise Exception(f"Error extracting text from PDF: {e}")
 
-    def call_llama_with_ollama(self, prompt: str, max_retries: int = 3) -> str:
-        """Call the Llama model through Ollama with retry logic."""
-        for attempt in range(max_retries):
-            try:
-                process = subprocess.Popen(
-                    ["ollama", "run", "llama3.2", prompt],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8'
-                    
-                )
-                
-                try:
-                    stdout, stderr = process.communicate(timeout=120)
-                    if process.returncode == 0:
-                        return stdout.strip()
-                    print(f"Attempt {attempt + 1} failed with error: {stderr}")
-                except subprocess.TimeoutExpired:
-                    process.kill()
-                    print(f"Attempt {attempt + 1} timed out")
-                    
-            except Exception as e:
-                print(f"Attempt {attempt + 1} failed with exception: {e}")
-            
-            if attempt < max_retries - 1:
-                time.sleep(3)
-                
-        return "Failed to generate explanation after multiple attempts."
+    def _extract_with_pdfium(self, pdf_path: str) -> Tuple[str, str]:
+        """Extract via pypdfium2 (PDFium), fanning pages out across worker processes."""
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            title = pdf.get_metadata_dict().get('Title', '')
+            page_count = len(pdf)
+        finally:
+            pdf.close()
+
+        if page_count > _MIN_PAGES_PER_SHARD:
+            # Split the document into one contiguous shard per worker; each
+            # worker reopens the document itself since PDFium handles are
+            # not picklable, so only (path, start, stop) crosses the boundary.
+            workers = min(os.cpu_count() or 1,
+                          page_count // _MIN_PAGES_PER_SHARD)
+            shard_size = -(-page_count // workers)
+            bounds = [(start, min(start + shard_size, page_count))
+                      for start in range(0, page_count, shard_size)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                shards = list(executor.map(_extract_page_range, repeat(pdf_path),
+                                           *zip(*bounds)))
+            text = ' '.join(shards)
+        else:
+            text = _extract_page_range(pdf_path, 0, page_count)
+
+        if not title:
+            title = text.split('\n')[0].strip()
+        return title, text
+
+    def _extract_with_pypdf2(self, pdf_path: str) -> Tuple[str, str]:
+        """Fallback extraction via PyPDF2 when pypdfium2 is unavailable."""
+        with open(pdf_path, "rb") as file:
+            pdf_reader = PdfReader(file)
+            title = pdf_reader.metadata.get('/Title', '')
+
+            if not title:
+                first_page_text = pdf_reader.pages[0].extract_text()
+                title = first_page_text.split('\n')[0].strip()
+
+            text = (page.extract_text() or "" for page in pdf_reader.pages)
+            return title, ' '.join(text)
+
+    @retry(stop=stop_after_attempt(3), wait=wait_fixed(3),
+           retry=retry_if_exception_type((httpx.TimeoutException, httpx.HTTPError, ResponseError)),
+           retry_error_callback=lambda _: "Failed to generate explanation after multiple attempts.")
+    def call_llama_with_ollama(self, prompt: str) -> str:
+        """Call the Llama model through Ollama over the persistent client, with retries."""
+        cached = self._llm_cache_get(prompt)
+        if cached is not None:
+            return cached
+        response = self._client.generate(
+            model='llama3.2',
+            prompt=prompt,
+            options=_SINGLE_LEVEL_OPTIONS
+        )
+        result = response['response'].strip()
+        self._llm_cache_set(prompt, result)
+        return result
+
+    @retry(stop=stop_after_attempt(3), wait=wait_fixed(3), reraise=True,
+           retry=retry_if_exception_type((httpx.TimeoutException, httpx.HTTPError, ResponseError)))
+    async def _acall(self, client: AsyncClient, prompt: str,
+                     options: Dict = _BATCH_OPTIONS) -> str:
+        """Send a single prompt to the Ollama HTTP API, reusing cached responses."""
+        cached = self._llm_cache_get(prompt)
+        if cached is not None:
+            return cached
+        response = await client.generate(model='llama3.2', prompt=prompt, options=options)
+        result = response['response'].strip()
+        self._llm_cache_set(prompt, result)
+        return result
+
+    def _build_batched_prompt(self, chunk: str, prompts: Dict[str, str]) -> str:
+        """Build one prompt asking for all three level explanations of a chunk."""
+        sections = '\n\n'.join(
+            f"=== {level.upper()} ===\n{template.rstrip(' :')} the text above."
+            for level, template in prompts.items()
+        )
+        return (f"{chunk}\n\nTASK: Write three explanations of the text above, "
+                f"one per section. Repeat each '=== LEVEL ===' header verbatim "
+                f"before its explanation, and write '=== END ===' after the "
+                f"last section.\n\n{sections}")
+
+    def _split_level_sections(self, response: str) -> Dict[str, str]:
+        """Split a batched response back into per-level explanations by marker."""
+        matches = list(_LEVEL_SECTION_RE.finditer(response))
+        sections = {}
+        for match, following in zip(matches, matches[1:] + [None]):
+            end = following.start() if following else len(response)
+            sections[match.group(1).lower()] = response[match.end():end].strip()
+        return sections
+
+    async def _explain_chunk(self, client: AsyncClient, chunk: str,
+                             prompts: Dict[str, str]) -> Dict[str, str]:
+        """Explain one chunk at every level with a single batched call."""
+        response = await self._acall(client, self._build_batched_prompt(chunk, prompts))
+        sections = self._split_level_sections(response)
+
+        # The model may ignore the markers entirely or drop some of them
+        # (e.g. when num_predict truncates the last section); fall back to
+        # one call per level for whichever levels are missing or empty.
+        missing = [level for level in prompts if not sections.get(level)]
+        if missing:
+            results = await asyncio.gather(
+                *[self._acall(client,
+                              f"{chunk}\n\nTASK: {prompts[level].rstrip(' :')} the text above.",
+                              options=_SINGLE_LEVEL_OPTIONS)
+                  for level in missing],
+                return_exceptions=True
+            )
+            for level, result in zip(missing, results):
+                if isinstance(result, str):
+                    sections[level] = result
+        return sections
+
+    async def _generate_explanations_async(self, prompts: Dict[str, str],
+                                           chunks: Iterable[str]) -> Dict[str, str]:
+        """Explain all chunks concurrently and collect results per level.
+
+        Each chunk is sent once, with the three level instructions
+        marshaled into marker-delimited sections of a single prompt, so
+        the chunk text is prefilled once instead of three times. Chunks
+        still run concurrently; Ollama-side concurrency is bounded by
+        OLLAMA_NUM_PARALLEL (8 works well with OLLAMA_MAX_LOADED_MODELS=1).
+        """
+        client = AsyncClient(host=os.environ.get('OLLAMA_HOST', 'http://localhost:11434'),
+                             timeout=120)
+        try:
+            results = await asyncio.gather(
+                *[self._explain_chunk(client, chunk, prompts) for chunk in chunks],
+                return_exceptions=True
+            )
+        finally:
+            await client._client.aclose()
+
+        explanations: Dict[str, List[str]] = {level: [] for level in prompts}
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                print(f"Chunk {index + 1} failed: {result}")
+                continue
+            for level, text in result.items():
+                if level in explanations and text:
+                    explanations[level].append(text)
+
+        return {level: '\n\n'.join(parts) if parts else "No explanation generated."
+                for level, parts in explanations.items()}
 
     def generate_explanations(self, note_text: str) -> Tuple[Dict[str, str], str]:
         """Generate explanations for different expertise levels."""
         content_type = self.detect_content_type(note_text)
         print(f"Detected content type: {content_type}")
-        
+
         prompts = self.generate_prompts(content_type)
         max_chunk_size = 3000
-        chunks = [note_text[i:i+max_chunk_size] for i in range(0, len(note_text), max_chunk_size)]
-        
-        explanations = {}
-        for level, prompt_template in prompts.items():
-            full_explanation = []
-            for chunk in chunks:
-                prompt = f"{prompt_template}\n\n{chunk}"
-                chunk_explanation = self.call_llama_with_ollama(prompt)
-                if chunk_explanation != "Failed to generate explanation after multiple attempts.":
-                    full_explanation.append(chunk_explanation)
-            
-            explanations[level] = '\n\n'.join(full_explanation) if full_explanation else "No explanation generated."
-        
+        chunks = _iter_chunks(note_text, max_chunk_size)
+
+        explanations = asyncio.run(self._generate_explanations_async(prompts, chunks))
         return explanations, content_type
 
     def create_level_pdf(self, content: str, title: str, level: str, content_type: str, 
@@ -208,29 +477,32 @@ class ContentExplainer:
         }
         level_subtitle = f"{level_titles[level]} - {content_type.title()} Content"
         story.append(Paragraph(level_subtitle, self.custom_styles['Heading1']))
-        story.append(Spacer(1, 0.3 * inch))
-        
-        # Process content sections
+        story.append(Spacer(1, _SUBTITLE_SPACE))
+
+        # Process content sections; hoist style lookups and the spacer
+        # (stateless, so one instance can repeat in the story) out of the loop.
+        topic_style = self.custom_styles['Topic']
+        normal_style = self.custom_styles['Normal']
+        section_spacer = Spacer(1, _SECTION_SPACE)
         sections = content.split('\n\n')
-        
+
         for section in sections:
             if not section.strip():
                 continue
-                
+
             section = section.strip()
-            if len(section) < 100 and any(char.isupper() for char in section):
-                story.append(Paragraph(section, self.custom_styles['Topic']))
+            if len(section) < 100 and _UPPERCASE_RE.search(section):
+                story.append(Paragraph(section, topic_style))
             else:
-                story.append(Paragraph(section.replace('\n', ' '), self.custom_styles['Normal']))
-                story.append(Spacer(1, 0.1 * inch))
+                story.append(Paragraph(section.replace('\n', ' '), normal_style))
+                story.append(section_spacer)
 
         doc.build(story)
         print(f"PDF created: {output_filename}")
 
     def cleanup(self) -> None:
         """Clean up temporary directory."""
-        if self.temp_image_dir.exists():
-            self.temp_image_dir.rmdir()
+        shutil.rmtree(self.temp_image_dir, ignore_errors=True)
 
 def main(pdf_path: str):
     """Main function to process a PDF file."""
@@ -239,9 +511,13 @@ def main(pdf_path: str):
         title, note_text = explainer.extract_text_and_title_from_pdf(pdf_path)
         explanations, content_type = explainer.generate_explanations(note_text)
 
-        for level, content in explanations.items():
-            output_filename = f"{level}_guide.pdf"
-            explainer.create_level_pdf(content, title, level, content_type, output_filename)
+        # Each level writes its own file, so the three builds can overlap.
+        with ThreadPoolExecutor(max_workers=len(explanations)) as executor:
+            futures = [executor.submit(explainer.create_level_pdf, content, title,
+                                       level, content_type, f"{level}_guide.pdf")
+                       for level, content in explanations.items()]
+            for future in futures:
+                future.result()
     
     finally:
         explainer.cleanup()
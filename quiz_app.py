@@ -39,23 +39,23 @@ class QuizApp:
         # Iterate over each question
         for i, mcq in enumerate(self.mcqs):
             print(f"\nQ{i+1}: {mcq['question']}")
+            # Valid inputs map straight to their option, so the loop below
+            # is a single dict lookup instead of int() parsing plus a range check.
+            choices = {}
             for j, option in enumerate(mcq['options'], 1):
                 print(f"  {j}. {option}")
-            
+                choices[str(j)] = option
+
             # Collect user's answer
             while True:
-                try:
-                    user_choice = int(input("Your answer (1-4): ").strip())
-                    if 1 <= user_choice <= 4:
-                        selected_option = mcq['options'][user_choice - 1]
-                        # Check if the answer is correct
-                        if selected_option == mcq['answer']:
-                            self.score += 1
-                        break
-                    else:
-                        print("Invalid choice, please select a number between 1 and 4.")
-                except ValueError:
-                    print("Invalid input, please enter a number.")
+                selected_option = choices.get(input("Your answer (1-4): ").strip())
+                if selected_option is None:
+                    print("Invalid choice, please select a number between 1 and 4.")
+                    continue
+                # Check if the answer is correct
+                if selected_option == mcq['answer']:
+                    self.score += 1
+                break
 
         return self.get_level()
 